@@ -0,0 +1,28 @@
+"""
+Gunicorn settings for the speaker diarization web interface
+
+    gunicorn -c gunicorn_conf.py web_app_subprocess:app
+    gunicorn -c gunicorn_conf.py web_app:app
+
+One worker process, because there is one GPU and every worker would load
+its own copy of the models; many threads, because the endpoints around
+the GPU work (status, events, downloads) are I/O-bound.
+
+web_app_subprocess keeps job status and the upload queue in memory, so it
+must stay at one worker: a second worker would not see the first one's
+jobs. Scale it with WEB_THREADS instead.
+"""
+
+import os
+
+bind = os.environ.get('WEB_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_WORKERS', '1'))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', '32'))
+
+# Uploads can take a while and /events streams stay open for a whole job
+timeout = 0
+keepalive = 5
+
+# Let send_file hand output files to the kernel with sendfile(2)
+sendfile = True
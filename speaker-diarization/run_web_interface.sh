@@ -20,4 +20,11 @@ echo ""
 
 source venv/bin/activate
 export PYTHONPATH="$(pwd):$PYTHONPATH"
+
+# Size concurrent GPU jobs from free VRAM (~8GB per job) unless already set
+if [ -z "$GPU_SLOTS" ]; then
+    GPU_SLOTS=$(python -c "import torch; print(max(1, torch.cuda.mem_get_info()[0] // (8 * 1024**3)) if torch.cuda.is_available() else 1)" 2>/dev/null || echo 1)
+fi
+export GPU_SLOTS
+echo "GPU slots: $GPU_SLOTS"
 python web_app_subprocess.py
\ No newline at end of file
@@ -10,16 +10,30 @@ License: MIT
 
 import whisperx
 import torch
-import gc
 import os
+import io
 import json
 import argparse
+import gc
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 import warnings
 warnings.filterwarnings("ignore")
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Whisper model sizes accepted by --whisper-model and the web interface
+WHISPER_MODELS = ("tiny", "base", "small", "medium", "large", "large-v2", "large-v3")
+
+# Prefix of the one-line JSON summary printed after each file
+SUMMARY_PREFIX = "DSC_SUMMARY "
+
 
 class SpeakerDiarizer:
     """
@@ -27,16 +41,63 @@ class SpeakerDiarizer:
     Includes automatic correction for common transcription errors.
     """
     
-    def __init__(self, hf_token=None, device=None):
+    # Short confirmations/responses
+    _INTERJECTION_RE = re.compile(r'^(Right|Yeah|Yes|No|Okay|Mm-hmm|Uh-huh)\.?$', re.I)
+    
+    def __init__(
+        self,
+        hf_token=None,
+        device=None,
+        backend="faster_whisper",
+        compute_type=None,
+        cpu_threads=None,
+        diarization_device=None
+    ):
         """
         Initialize the diarizer.
         
         Args:
             hf_token: HuggingFace token for PyAnnote access
             device: "cuda" or "cpu" (auto-detected if None)
+            backend: "faster_whisper" (batched inference) or "whisperx"
+            compute_type: CTranslate2 compute type for the Whisper model
+                (int8_float16 on CUDA, int8 on CPU if None)
+            cpu_threads: CTranslate2 CPU threads for faster-whisper
+                (all cores if None)
+            diarization_device: Device for PyAnnote diarization (the second
+                GPU when more than one is visible, otherwise `device`)
         """
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
         self.hf_token = hf_token or os.environ.get("HF_TOKEN")
+        self.backend = backend
+        self.compute_type = compute_type or ("int8_float16" if self.device == "cuda" else "int8")
+        self.cpu_threads = cpu_threads or os.cpu_count()
+        if diarization_device is None:
+            # Diarization runs alongside transcription; with a second GPU
+            # the two stop competing for the same device
+            multi_gpu = self.device == "cuda" and torch.cuda.device_count() > 1
+            diarization_device = "cuda:1" if multi_gpu else self.device
+        self.diarization_device = diarization_device
+        
+        if self.device == "cuda":
+            # TF32 tensor cores for fp32 matmuls/convolutions in the PyTorch
+            # models (alignment, diarization); negligible accuracy cost
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.allow_tf32 = True
+        
+        # Models are loaded on first use and kept for the lifetime of the
+        # diarizer, so repeated jobs in one process skip the reload. Only the
+        # most recently used Whisper model stays resident.
+        # The locks serialise use of each model across caller threads.
+        self._asr_cache = {}
+        self._align_cache = {}
+        self._diar_model = None
+        self._asr_lock = threading.Lock()
+        self._align_lock = threading.Lock()
+        self._diar_lock = threading.Lock()
+        # Runs diarization alongside transcription; one thread is enough
+        # since _diar_lock serialises the pipeline anyway
+        self._diar_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="diarize")
         
         # Common transcription corrections for academic discourse
         self.word_corrections = {
@@ -51,18 +112,28 @@ class SpeakerDiarizer:
             "Bond and Reading": "The Babysitters Club",
             "deep personalized": "depersonalized"
         }
+        # One alternation for all corrections (longest first, so a longer
+        # phrase wins over any key that is its prefix)
+        self._corr_re = re.compile("|".join(
+            sorted((re.escape(k) for k in self.word_corrections), key=len, reverse=True)
+        ))
+        self._corr_table = self.word_corrections
+        # Any match must start with one of these; lets clean text skip the regex
+        self._corr_first_chars = frozenset(k[0] for k in self.word_corrections)
         
         print(f"Initialized with device: {self.device}")
         if self.device == "cuda":
             print(f"GPU: {torch.cuda.get_device_name(0)}")
+        if self.diarization_device != self.device:
+            print(f"Diarization device: {self.diarization_device}")
     
     def transcribe_with_speakers(
         self,
         audio_file,
-        whisper_model="base",
+        whisper_model=None,
         language="en",
         num_speakers=2,
-        batch_size=8,
+        batch_size=None,
         apply_corrections=True
     ):
         """
@@ -70,75 +141,78 @@ class SpeakerDiarizer:
         
         Args:
             audio_file: Path to audio file
-            whisper_model: Whisper model size (tiny, base, small, medium, large, large-v3)
+            whisper_model: Whisper model size (tiny, base, small, medium, large, large-v2, large-v3);
+                defaults to large-v2 on CUDA and base on CPU
             language: Language code or None for auto-detection
             num_speakers: Expected number of speakers
-            batch_size: Processing batch size
+            batch_size: Processing batch size (16 on CUDA, 8 on CPU if None)
             apply_corrections: Whether to apply automatic corrections
         
         Returns:
             Dictionary with segments containing speaker labels and text
         """
+        if whisper_model is None:
+            whisper_model = "large-v2" if self.device == "cuda" else "base"
+        
         print(f"\nProcessing: {audio_file}")
         print(f"Model: {whisper_model}, Language: {language}, Speakers: {num_speakers}")
         print("-" * 50)
         
+        if batch_size is None:
+            batch_size = 16 if self.device == "cuda" else 8
+        
+        audio = whisperx.load_audio(audio_file)
+        
+        # Diarization only needs the raw audio, so start it now and let it
+        # run alongside transcription + alignment.
+        diar_future = None
+        if self.hf_token:
+            diar_future = self._diar_executor.submit(self._run_diarization, audio, num_speakers)
+        
         # Step 1: Transcription
         print("\n1. Transcribing audio...")
-        compute_type = "float16" if self.device == "cuda" else "float32"
-        
-        model = whisperx.load_model(
-            whisper_model,
-            self.device,
-            compute_type=compute_type,
-            language=language
-        )
         
-        audio = whisperx.load_audio(audio_file)
-        result = model.transcribe(audio, batch_size=batch_size, language=language)
+        with self._asr_lock, torch.inference_mode():
+            model = self._get_asr(whisper_model, language)
+            if self.backend == "faster_whisper":
+                segments, info = model.transcribe(
+                    audio,
+                    batch_size=batch_size,
+                    language=language,
+                    word_timestamps=True
+                )
+                result = {
+                    "segments": [self._fw_segment_to_dict(seg) for seg in segments],
+                    "language": info.language
+                }
+            else:
+                result = model.transcribe(audio, batch_size=batch_size, language=language)
         
         print(f"   ✓ Transcribed {len(result['segments'])} segments")
         
-        # Cleanup
-        del model
-        gc.collect()
-        if self.device == "cuda":
-            torch.cuda.empty_cache()
-        
         # Step 2: Alignment
         print("\n2. Aligning timestamps...")
         try:
-            model_a, metadata = whisperx.load_align_model(
-                language_code=result.get("language", "en"),
-                device=self.device
-            )
-            result = whisperx.align(
-                result["segments"],
-                model_a,
-                metadata,
-                audio,
-                self.device,
-                return_char_alignments=False
-            )
-            del model_a
-            gc.collect()
+            with self._align_lock, torch.inference_mode():
+                model_a, metadata = self._get_align(result.get("language", "en"))
+                result = whisperx.align(
+                    result["segments"],
+                    model_a,
+                    metadata,
+                    audio,
+                    self.device,
+                    return_char_alignments=False
+                )
             print("   ✓ Alignment complete")
         except Exception as e:
             print(f"   ⚠ Alignment skipped: {e}")
             result = {"segments": result["segments"]}
         
         # Step 3: Speaker Diarization
-        if self.hf_token:
+        if diar_future is not None:
             print("\n3. Identifying speakers...")
             try:
-                from whisperx.diarize import DiarizationPipeline
-                
-                diarize_model = DiarizationPipeline(
-                    use_auth_token=self.hf_token,
-                    device=self.device
-                )
-                
-                diarize_segments = diarize_model(audio, num_speakers=num_speakers)
+                diarize_segments = diar_future.result()
                 result = whisperx.assign_word_speakers(diarize_segments, result)
                 
                 # Count speakers
@@ -163,6 +237,89 @@ class SpeakerDiarizer:
         
         return result
     
+    def _get_asr(self, whisper_model, language):
+        """Return the cached ASR model for (whisper_model, language), loading on miss."""
+        key = (whisper_model, language)
+        model = self._asr_cache.get(key)
+        if model is None:
+            # Free the previous model before loading another one
+            self._asr_cache.clear()
+            gc.collect()
+            if self.device == "cuda":
+                torch.cuda.empty_cache()
+            
+            if self.backend == "faster_whisper":
+                from faster_whisper import WhisperModel, BatchedInferencePipeline
+                
+                model = BatchedInferencePipeline(
+                    model=WhisperModel(
+                        whisper_model,
+                        device=self.device,
+                        compute_type=self.compute_type,
+                        cpu_threads=self.cpu_threads
+                    )
+                )
+            else:
+                model = whisperx.load_model(
+                    whisper_model,
+                    self.device,
+                    compute_type=self.compute_type,
+                    language=language
+                )
+            self._asr_cache[key] = model
+        return model
+    
+    def _get_align(self, language_code):
+        """Return the cached (model, metadata) alignment pair for a language."""
+        if language_code not in self._align_cache:
+            self._align_cache[language_code] = whisperx.load_align_model(
+                language_code=language_code,
+                device=self.device
+            )
+        return self._align_cache[language_code]
+    
+    def _run_diarization(self, audio, num_speakers):
+        """
+        Run PyAnnote diarization on the decoded audio.
+        
+        `audio` must be the 16 kHz float32 array from whisperx.load_audio,
+        not a path: DiarizationPipeline wraps an array as an in-memory
+        {"waveform", "sample_rate"} input (sharing its memory via
+        torch.from_numpy), whereas a path would be decoded again by ffmpeg.
+        
+        Called from a worker thread; on CUDA the work is issued on its own
+        stream so it interleaves with transcription kernels instead of
+        queueing behind them on the default stream (or runs on a GPU of
+        its own, see `diarization_device`).
+        """
+        with self._diar_lock, torch.inference_mode():
+            if self._diar_model is None:
+                from whisperx.diarize import DiarizationPipeline
+                
+                self._diar_model = DiarizationPipeline(
+                    use_auth_token=self.hf_token,
+                    device=self.diarization_device
+                )
+            
+            if self.diarization_device.startswith("cuda"):
+                with torch.cuda.stream(torch.cuda.Stream(device=self.diarization_device)):
+                    return self._diar_model(audio, num_speakers=num_speakers)
+            return self._diar_model(audio, num_speakers=num_speakers)
+    
+    @staticmethod
+    def _fw_segment_to_dict(segment):
+        """Convert a faster-whisper Segment to the dict layout WhisperX uses."""
+        words = [
+            {"word": w.word, "start": w.start, "end": w.end, "score": w.probability}
+            for w in (segment.words or [])
+        ]
+        return {
+            "start": segment.start,
+            "end": segment.end,
+            "text": segment.text,
+            "words": words
+        }
+    
     def apply_corrections(self, result):
         """
         Apply automatic corrections to transcript.
@@ -173,12 +330,12 @@ class SpeakerDiarizer:
         Returns:
             Corrected transcript
         """
-        for segment in result.get("segments", []):
+        for segment in result.get("segments") or []:
             text = segment.get("text", "")
             
-            # Apply word corrections
-            for error, correction in self.word_corrections.items():
-                text = text.replace(error, correction)
+            # Apply word corrections in a single pass
+            if not self._corr_first_chars.isdisjoint(text):
+                text = self._corr_re.sub(lambda m: self._corr_table[m.group(0)], text)
             
             segment["text"] = text
             
@@ -191,13 +348,12 @@ class SpeakerDiarizer:
     def _is_interjection(self, text):
         """Check if text is likely an interjection."""
         text = text.strip()
-        # Short confirmations/responses
-        if re.match(r'^(Right|Yeah|Yes|No|Okay|Mm-hmm|Uh-huh)\.?$', text, re.I):
+        if not text:
             return True
-        # Very short segments (less than 4 words)
-        if len(text.split()) <= 3:
+        if self._INTERJECTION_RE.match(text):
             return True
-        return False
+        # Very short segments (less than 4 words)
+        return len(text.split(None, 3)) <= 3
     
     def save_outputs(self, result, base_name, output_dir="output"):
         """
@@ -211,11 +367,14 @@ class SpeakerDiarizer:
         output_path = Path(output_dir)
         output_path.mkdir(exist_ok=True)
         
+        segments = result.get("segments") or []
+        
+        # Text and SRT are rendered together in one pass over the segments
+        transcript, srt_content = self._render_all(segments)
+        
         # 1. Text transcript
-        transcript = self.format_transcript(result)
         txt_path = output_path / f"{base_name}.txt"
-        with open(txt_path, "w", encoding="utf-8") as f:
-            f.write(transcript)
+        self._write_atomic(txt_path, transcript.encode("utf-8"))
         print(f"   ✓ Text: {txt_path}")
         
         # 2. JSON data
@@ -223,80 +382,94 @@ class SpeakerDiarizer:
             "metadata": {
                 "processed_at": datetime.now().isoformat(),
                 "device": self.device,
-                "total_segments": len(result.get("segments", []))
+                "total_segments": len(segments)
             },
-            "segments": result.get("segments", [])
+            "segments": segments
         }
         json_path = output_path / f"{base_name}.json"
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(json_data, f, indent=2, ensure_ascii=False)
+        if orjson is not None:
+            json_bytes = orjson.dumps(
+                json_data,
+                option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+            )
+        else:
+            json_bytes = json.dumps(json_data, indent=2, ensure_ascii=False).encode("utf-8")
+        self._write_atomic(json_path, json_bytes)
         print(f"   ✓ JSON: {json_path}")
         
         # 3. SRT subtitles
-        srt_content = self.generate_srt(result)
         srt_path = output_path / f"{base_name}.srt"
-        with open(srt_path, "w", encoding="utf-8") as f:
-            f.write(srt_content)
+        self._write_atomic(srt_path, srt_content.encode("utf-8"))
         print(f"   ✓ SRT: {srt_path}")
     
+    @staticmethod
+    def _write_atomic(path, data):
+        """
+        Write bytes to path via a temporary file and os.replace, so a
+        crash mid-write never leaves a partial output behind.
+        """
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    
     def format_transcript(self, result):
         """Format transcript with speaker labels."""
-        lines = ["TRANSCRIPT WITH SPEAKER DIARIZATION", "=" * 50, ""]
+        return self._render_all(result.get("segments") or [])[0]
+    
+    def generate_srt(self, result):
+        """Generate SRT subtitle format."""
+        return self._render_all(result.get("segments") or [])[1]
+    
+    def _render_all(self, segments):
+        """
+        Render the text transcript and SRT subtitles in a single pass.
         
+        Args:
+            segments: Transcript segments
+        
+        Returns:
+            Tuple of (transcript text, SRT content)
+        """
+        txt_buf = io.StringIO()
+        srt_buf = io.StringIO()
+        write_txt = txt_buf.write
+        write_srt = srt_buf.write
+        fmt = self._format_srt_time
+        
+        write_txt("TRANSCRIPT WITH SPEAKER DIARIZATION\n" + "=" * 50 + "\n")
         current_speaker = None
-        speaker_text = []
         
-        for segment in result.get("segments", []):
+        for i, segment in enumerate(segments, 1):
             speaker = segment.get("speaker", "UNKNOWN")
             text = segment.get("text", "").strip()
             
+            # SRT record
+            start = fmt(segment.get("start", 0))
+            end = fmt(segment.get("end", 0))
+            write_srt(f"{i}\n{start} --> {end}\n[{speaker}]: {text}\n\n")
+            
             # Mark interjections
             if segment.get("interjection"):
                 text = f"*{text}*"
             
+            # Transcript, grouped into speaker turns
             if speaker != current_speaker:
-                if current_speaker and speaker_text:
-                    lines.append(f"\n[{current_speaker}]:")
-                    lines.append(" ".join(speaker_text))
                 current_speaker = speaker
-                speaker_text = [text]
-            else:
-                speaker_text.append(text)
-        
-        # Don't forget last speaker
-        if current_speaker and speaker_text:
-            lines.append(f"\n[{current_speaker}]:")
-            lines.append(" ".join(speaker_text))
-        
-        return "\n".join(lines)
-    
-    def generate_srt(self, result):
-        """Generate SRT subtitle format."""
-        srt_lines = []
-        
-        for i, segment in enumerate(result.get("segments", []), 1):
-            start = segment.get("start", 0)
-            end = segment.get("end", 0)
-            speaker = segment.get("speaker", "UNKNOWN")
-            text = segment.get("text", "").strip()
-            
-            # Format timestamps
-            start_time = self._format_srt_time(start)
-            end_time = self._format_srt_time(end)
-            
-            srt_lines.append(str(i))
-            srt_lines.append(f"{start_time} --> {end_time}")
-            srt_lines.append(f"[{speaker}]: {text}")
-            srt_lines.append("")
-        
-        return "\n".join(srt_lines)
+                if speaker:
+                    write_txt(f"\n\n[{speaker}]:\n")
+                    write_txt(text)
+            elif speaker:
+                write_txt(" ")
+                write_txt(text)
+        
+        return txt_buf.getvalue(), srt_buf.getvalue()
     
     def _format_srt_time(self, seconds):
         """Format seconds to SRT timestamp."""
-        hours = int(seconds // 3600)
-        minutes = int((seconds % 3600) // 60)
-        secs = int(seconds % 60)
-        millis = int((seconds % 1) * 1000)
+        secs, millis = divmod(round(seconds * 1000), 1000)
+        minutes, secs = divmod(secs, 60)
+        hours, minutes = divmod(minutes, 60)
         return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
 
 
@@ -307,8 +480,10 @@ def main():
     )
     
     parser.add_argument(
-        "audio_file",
-        help="Path to audio file (MP3, WAV, etc.)"
+        "audio_files",
+        nargs="+",
+        metavar="audio_file",
+        help="Path to audio file (MP3, WAV, etc.); several files share one model load"
     )
     
     parser.add_argument(
@@ -319,9 +494,8 @@ def main():
     
     parser.add_argument(
         "--whisper-model",
-        default="base",
-        choices=["tiny", "base", "small", "medium", "large", "large-v3"],
-        help="Whisper model size (default: base)"
+        choices=WHISPER_MODELS,
+        help="Whisper model size (default: large-v2 on CUDA, base on CPU)"
     )
     
     parser.add_argument(
@@ -354,36 +528,76 @@ def main():
         help="Force specific device (auto-detected by default)"
     )
     
+    parser.add_argument(
+        "--diarization-device",
+        help="Device for speaker diarization, e.g. cuda:1 (default: second GPU if present)"
+    )
+    
     parser.add_argument(
         "--batch-size",
         type=int,
-        default=8,
-        help="Batch size for processing (default: 8)"
+        help="Batch size for processing (default: 16 on CUDA, 8 on CPU)"
+    )
+    
+    parser.add_argument(
+        "--compute-type",
+        choices=["int8_float16", "int8", "float16", "float32"],
+        help="Whisper compute type (default: int8_float16 on CUDA, int8 on CPU)"
+    )
+    
+    parser.add_argument(
+        "--cpu-threads",
+        type=int,
+        help="CPU threads for faster-whisper (default: all cores)"
+    )
+    
+    parser.add_argument(
+        "--backend",
+        default="faster_whisper",
+        choices=["faster_whisper", "whisperx"],
+        help="Transcription backend (default: faster_whisper)"
     )
     
     args = parser.parse_args()
     
     # Validate input
-    if not Path(args.audio_file).exists():
-        print(f"Error: Audio file not found: {args.audio_file}")
+    missing = [f for f in args.audio_files if not Path(f).exists()]
+    for audio_file in missing:
+        print(f"Error: Audio file not found: {audio_file}")
+    audio_files = [f for f in args.audio_files if f not in missing]
+    if not audio_files:
         return 1
     
     print("=" * 60)
     print("SPEAKER DIARIZATION PIPELINE")
     print("=" * 60)
-    print(f"Audio: {args.audio_file}")
-    print(f"Size: {Path(args.audio_file).stat().st_size / 1024 / 1024:.2f} MB")
+    for audio_file in audio_files:
+        print(f"Audio: {audio_file}")
+        print(f"Size: {Path(audio_file).stat().st_size / 1024 / 1024:.2f} MB")
     
-    # Initialize diarizer
+    # Initialize diarizer (models are loaded once and reused for every file)
     diarizer = SpeakerDiarizer(
         hf_token=args.hf_token,
-        device=args.device
+        device=args.device,
+        backend=args.backend,
+        compute_type=args.compute_type,
+        cpu_threads=args.cpu_threads,
+        diarization_device=args.diarization_device
     )
     
-    # Process audio
+    failed = len(missing)
+    for audio_file in audio_files:
+        if not process_file(diarizer, audio_file, args):
+            failed += 1
+    
+    return 1 if failed else 0
+
+
+def process_file(diarizer, audio_file, args):
+    """Transcribe, save and summarise one file. Returns True on success."""
     try:
         result = diarizer.transcribe_with_speakers(
-            args.audio_file,
+            audio_file,
             whisper_model=args.whisper_model,
             language=args.language,
             num_speakers=args.num_speakers,
@@ -393,11 +607,11 @@ def main():
         
         # Save outputs
         print("\n5. Saving outputs...")
-        base_name = Path(args.audio_file).stem + "_transcribed"
+        base_name = Path(audio_file).stem + "_transcribed"
         diarizer.save_outputs(result, base_name, args.output_dir)
         
         # Summary
-        segments = result.get("segments", [])
+        segments = result.get("segments") or []
         speakers = set(seg.get("speaker", "UNKNOWN") for seg in segments)
         
         print("\n" + "=" * 60)
@@ -413,13 +627,17 @@ def main():
         print(f"\n✓ Processing complete!")
         print(f"✓ Check '{args.output_dir}' directory for outputs")
         
+        # Machine-readable summary for the web interface
+        summary = {"segments": len(segments), "speakers": len(speakers)}
+        print(f"{SUMMARY_PREFIX}{json.dumps(summary)}", flush=True)
+        
     except Exception as e:
         print(f"\n✗ Error: {e}")
         import traceback
         traceback.print_exc()
-        return 1
+        return False
     
-    return 0
+    return True
 
 
 if __name__ == "__main__":
@@ -4,10 +4,13 @@ Simple web interface for speaker diarization pipeline
 Provides upload, processing, and transcript viewing capabilities
 """
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, send_file
 from werkzeug.utils import secure_filename
 import os
+import importlib.util
 import json
+import shutil
+import sqlite3
 import threading
 import queue
 import time
@@ -15,27 +18,118 @@ from pathlib import Path
 from datetime import datetime
 import sys
 
+# `python web_app.py` hands the process over to gunicorn before any of the
+# module-level setup below runs. The gunicorn worker imports web_app:app
+# itself, so nothing is initialised twice or carried across its fork.
+if __name__ == '__main__':
+    print("=" * 60)
+    print("SPEAKER DIARIZATION WEB INTERFACE")
+    print("=" * 60)
+    print()
+    
+    # Check for HF_TOKEN
+    if not os.environ.get('HF_TOKEN'):
+        print("⚠️  Warning: HF_TOKEN not set")
+        print("   Speaker diarization will not work without it.")
+        print("   Set it with: export HF_TOKEN='your_token_here'")
+        print()
+    
+    print("Starting server at http://localhost:5000")
+    print("Press Ctrl+C to stop")
+    print()
+    
+    if not os.environ.get('DSC_DEV'):
+        if importlib.util.find_spec('gunicorn') is None:
+            print("gunicorn not installed, falling back to the Flask development server")
+        else:
+            os.execvp(sys.executable, [
+                sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_conf.py', 'web_app:app'
+            ])
+
 # Import our transcription module
-from transcribe_with_speakers import SpeakerDiarizer
+from transcribe_with_speakers import SpeakerDiarizer, WHISPER_MODELS
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
+app.config['MAX_FORM_MEMORY_SIZE'] = 4 * 1024 * 1024  # Non-file form fields only
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'output'
+app.config['STATUS_DB'] = 'status.db'
+app.config['MAX_JOBS'] = 500  # Oldest finished jobs beyond this are dropped
+# Behind a proxy that honours X-Sendfile, let it serve the downloads itself
+app.use_x_sendfile = os.environ.get('DSC_X_SENDFILE') == '1'
 
 # Ensure directories exist
 Path(app.config['UPLOAD_FOLDER']).mkdir(exist_ok=True)
 Path(app.config['OUTPUT_FOLDER']).mkdir(exist_ok=True)
 
-# Global storage for processing status
-processing_status = {}
-processing_lock = threading.Lock()
+# Processing status lives in SQLite. Each thread gets its own connection, so
+# with WAL mode status reads proceed while a worker thread is writing
+_status_local = threading.local()
+
+def status_db():
+    """Return this thread's connection to the status database"""
+    conn = getattr(_status_local, 'conn', None)
+    if conn is None:
+        conn = _status_local.conn = sqlite3.connect(app.config['STATUS_DB'], isolation_level=None)
+    return conn
+
+status_db().execute('PRAGMA journal_mode=WAL')
+status_db().execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, end_time TEXT, data TEXT NOT NULL)')
+status_write_lock = threading.Lock()
+
+# Bumped and broadcast on every status write so /events streams can wake up
+status_changed = threading.Condition()
+status_version = 0
+
+def read_status(job_id):
+    """Return the status dict for a job, or None if unknown"""
+    row = status_db().execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def set_status(job_id, **fields):
+    """Replace a job's status with the given fields"""
+    with status_write_lock:
+        _write_status(job_id, fields)
+
+def update_status(job_id, **fields):
+    """Merge the given fields into a job's existing status, if it still has one"""
+    with status_write_lock:
+        status = read_status(job_id)
+        if status is None:
+            return
+        status.update(fields)
+        _write_status(job_id, status)
+
+def _write_status(job_id, status):
+    global status_version
+    status_db().execute(
+        'INSERT INTO jobs (id, end_time, data) VALUES (?, ?, ?) '
+        'ON CONFLICT(id) DO UPDATE SET end_time = excluded.end_time, data = excluded.data',
+        (job_id, status.get('end_time'), json.dumps(status))
+    )
+    # Only finished jobs are dropped; queued and running ones keep their rows
+    status_db().execute(
+        'DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE end_time IS NOT NULL '
+        'ORDER BY rowid LIMIT max((SELECT COUNT(*) FROM jobs) - ?, 0))',
+        (app.config['MAX_JOBS'],)
+    )
+    with status_changed:
+        status_version += 1
+        status_changed.notify_all()
+
+# Shared diarizer so model weights stay loaded across jobs
+DIARIZER = SpeakerDiarizer(hf_token=os.environ.get('HF_TOKEN'))
+
+# Limit how many jobs run on the GPU at once; the rest queue here
+GPU_SEM = threading.BoundedSemaphore(int(os.environ.get('GPU_SLOTS', '2')))
 
 # Allowed audio extensions
-ALLOWED_EXTENSIONS = {'mp3', 'wav', 'm4a', 'flac', 'ogg', 'opus', 'webm'}
+ALLOWED_EXTENSIONS = frozenset(('mp3', 'wav', 'm4a', 'flac', 'ogg', 'opus', 'webm'))
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    _, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in ALLOWED_EXTENSIONS
 
 class ProcessingThread(threading.Thread):
     """Background thread for audio processing"""
@@ -50,73 +144,60 @@ class ProcessingThread(threading.Thread):
         
     def run(self):
         """Run the transcription process"""
-        global processing_status
-        
         try:
             # Update status
-            with processing_lock:
-                processing_status[self.job_id] = {
-                    'status': 'processing',
-                    'progress': 10,
-                    'message': 'Initializing...',
-                    'start_time': datetime.now().isoformat()
-                }
-            
-            # Initialize diarizer
-            hf_token = os.environ.get('HF_TOKEN')
-            if not hf_token:
-                with processing_lock:
-                    processing_status[self.job_id]['message'] = 'Warning: No HF_TOKEN, speaker diarization disabled'
-            
-            diarizer = SpeakerDiarizer(hf_token=hf_token)
+            update_status(
+                self.job_id,
+                status='processing',
+                progress=10,
+                message='Initializing...'
+            )
             
-            # Update progress
-            with processing_lock:
-                processing_status[self.job_id]['progress'] = 30
-                processing_status[self.job_id]['message'] = 'Loading audio file...'
+            if not DIARIZER.hf_token:
+                update_status(self.job_id, message='Warning: No HF_TOKEN, speaker diarization disabled')
             
-            # Process audio
-            result = diarizer.transcribe_with_speakers(
-                self.file_path,
-                whisper_model=self.whisper_model,
-                num_speakers=self.num_speakers,
-                batch_size=8
-            )
+            # Process audio once a GPU slot is free
+            update_status(self.job_id, progress=20, message='Waiting for GPU slot...')
+            with GPU_SEM:
+                update_status(self.job_id, progress=30, message='Loading audio file...')
+                result = DIARIZER.transcribe_with_speakers(
+                    self.file_path,
+                    whisper_model=self.whisper_model,
+                    num_speakers=self.num_speakers
+                )
             
             # Update progress
-            with processing_lock:
-                processing_status[self.job_id]['progress'] = 80
-                processing_status[self.job_id]['message'] = 'Saving results...'
+            update_status(self.job_id, progress=80, message='Saving results...')
             
             # Save outputs
             base_name = Path(self.file_path).stem
             output_base = f"{self.job_id}_{base_name}"
-            diarizer.save_outputs(result, output_base, app.config['OUTPUT_FOLDER'])
+            DIARIZER.save_outputs(result, output_base, app.config['OUTPUT_FOLDER'])
             
             # Update final status
-            with processing_lock:
-                processing_status[self.job_id] = {
-                    'status': 'completed',
-                    'progress': 100,
-                    'message': 'Processing complete!',
-                    'output_files': {
-                        'text': f"{output_base}.txt",
-                        'json': f"{output_base}.json",
-                        'srt': f"{output_base}.srt"
-                    },
-                    'segments': len(result.get('segments', [])),
-                    'end_time': datetime.now().isoformat()
-                }
+            set_status(
+                self.job_id,
+                status='completed',
+                progress=100,
+                message='Processing complete!',
+                output_files={
+                    'text': f"{output_base}.txt",
+                    'json': f"{output_base}.json",
+                    'srt': f"{output_base}.srt"
+                },
+                segments=len(result.get('segments', [])),
+                end_time=datetime.now().isoformat()
+            )
                 
         except Exception as e:
             # Handle errors
-            with processing_lock:
-                processing_status[self.job_id] = {
-                    'status': 'error',
-                    'progress': 0,
-                    'message': f'Error: {str(e)}',
-                    'end_time': datetime.now().isoformat()
-                }
+            set_status(
+                self.job_id,
+                status='error',
+                progress=0,
+                message=f'Error: {str(e)}',
+                end_time=datetime.now().isoformat()
+            )
 
 @app.route('/')
 def index():
@@ -137,18 +218,32 @@ def upload_file():
     if not allowed_file(file.filename):
         return jsonify({'error': f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS)}'}), 400
     
+    whisper_model = request.form.get('model', 'base')
+    if whisper_model not in WHISPER_MODELS:
+        return jsonify({'error': f'Invalid model. Allowed: {", ".join(WHISPER_MODELS)}'}), 400
+    
     # Save uploaded file
     filename = secure_filename(file.filename)
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     job_id = f"{timestamp}_{Path(filename).stem}"
     
     file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}_{filename}")
-    file.save(file_path)
+    # Copy straight to the final path in 1MB chunks
+    with open(file_path, 'wb', buffering=0) as dst:
+        shutil.copyfileobj(file.stream, dst, length=1024 * 1024)
     
     # Get processing parameters
-    whisper_model = request.form.get('model', 'base')
     num_speakers = int(request.form.get('speakers', 2))
     
+    # Record the job before returning its id, so /status and /events find it
+    set_status(
+        job_id,
+        status='pending',
+        progress=0,
+        message='Waiting to start...',
+        start_time=datetime.now().isoformat()
+    )
+    
     # Start processing in background
     processor = ProcessingThread(file_path, job_id, whisper_model, num_speakers)
     processor.start()
@@ -162,85 +257,105 @@ def upload_file():
 @app.route('/status/<job_id>')
 def get_status(job_id):
     """Get processing status"""
-    with processing_lock:
-        if job_id in processing_status:
-            return jsonify(processing_status[job_id])
-        else:
-            return jsonify({'error': 'Job not found'}), 404
+    status = read_status(job_id)
+    if status is not None:
+        return jsonify(status)
+    else:
+        return jsonify({'error': 'Job not found'}), 404
+
+@app.route('/events/<job_id>')
+def stream_status(job_id):
+    """Stream status changes as Server-Sent Events until the job finishes"""
+    if read_status(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def generate():
+        last_sent = None
+        while True:
+            seen = status_version
+            status = read_status(job_id)
+            if status is None:
+                return
+            data = json.dumps(status)
+            if data != last_sent:
+                yield f"data: {data}\n\n"
+                last_sent = data
+            if status['status'] in ('completed', 'error'):
+                return
+            with status_changed:
+                changed = status_changed.wait_for(lambda: status_version != seen, timeout=15)
+            if not changed:
+                yield ": keepalive\n\n"
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/transcript/<job_id>')
 def get_transcript(job_id):
     """Get transcript content"""
-    with processing_lock:
-        if job_id not in processing_status:
-            return jsonify({'error': 'Job not found'}), 404
-        
-        status = processing_status[job_id]
-        if status['status'] != 'completed':
-            return jsonify({'error': 'Processing not complete'}), 400
-        
-        # Read transcript file
-        txt_file = os.path.join(app.config['OUTPUT_FOLDER'], status['output_files']['text'])
-        if not os.path.exists(txt_file):
-            return jsonify({'error': 'Transcript file not found'}), 404
-        
-        with open(txt_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        return jsonify({
-            'content': content,
-            'filename': status['output_files']['text']
-        })
+    status = read_status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if status['status'] != 'completed':
+        return jsonify({'error': 'Processing not complete'}), 400
+    
+    # Read transcript file
+    txt_file = os.path.join(app.config['OUTPUT_FOLDER'], status['output_files']['text'])
+    if not os.path.exists(txt_file):
+        return jsonify({'error': 'Transcript file not found'}), 404
+    
+    with open(txt_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    
+    return jsonify({
+        'content': content,
+        'filename': status['output_files']['text']
+    })
 
 @app.route('/download/<job_id>/<file_type>')
 def download_file(job_id, file_type):
     """Download output file"""
-    with processing_lock:
-        if job_id not in processing_status:
-            return jsonify({'error': 'Job not found'}), 404
-        
-        status = processing_status[job_id]
-        if status['status'] != 'completed':
-            return jsonify({'error': 'Processing not complete'}), 400
-        
-        if file_type not in ['text', 'json', 'srt']:
-            return jsonify({'error': 'Invalid file type'}), 400
-        
-        file_path = os.path.join(app.config['OUTPUT_FOLDER'], status['output_files'][file_type])
-        if not os.path.exists(file_path):
-            return jsonify({'error': 'File not found'}), 404
-        
-        return send_file(file_path, as_attachment=True)
+    status = read_status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if status['status'] != 'completed':
+        return jsonify({'error': 'Processing not complete'}), 400
+    
+    if file_type not in ['text', 'json', 'srt']:
+        return jsonify({'error': 'Invalid file type'}), 400
+    
+    file_path = os.path.join(app.config['OUTPUT_FOLDER'], status['output_files'][file_type])
+    if not os.path.exists(file_path):
+        return jsonify({'error': 'File not found'}), 404
+    
+    # Conditional + range responses; under gunicorn the body goes out via sendfile(2)
+    return send_file(
+        file_path,
+        as_attachment=True,
+        conditional=True,
+        etag=True,
+        max_age=3600,
+        last_modified=os.path.getmtime(file_path)
+    )
 
 @app.route('/jobs')
 def list_jobs():
     """List all processing jobs"""
-    with processing_lock:
-        jobs = []
-        for job_id, status in processing_status.items():
-            jobs.append({
-                'id': job_id,
-                'status': status['status'],
-                'message': status.get('message', ''),
-                'progress': status.get('progress', 0)
-            })
-        return jsonify(jobs)
+    jobs = []
+    for job_id, data in status_db().execute('SELECT id, data FROM jobs ORDER BY rowid'):
+        status = json.loads(data)
+        jobs.append({
+            'id': job_id,
+            'status': status['status'],
+            'message': status.get('message', ''),
+            'progress': status.get('progress', 0)
+        })
+    return jsonify(jobs)
 
 if __name__ == '__main__':
-    print("=" * 60)
-    print("SPEAKER DIARIZATION WEB INTERFACE")
-    print("=" * 60)
-    print()
-    
-    # Check for HF_TOKEN
-    if not os.environ.get('HF_TOKEN'):
-        print("⚠️  Warning: HF_TOKEN not set")
-        print("   Speaker diarization will not work without it.")
-        print("   Set it with: export HF_TOKEN='your_token_here'")
-        print()
-    
-    print("Starting server at http://localhost:5000")
-    print("Press Ctrl+C to stop")
-    print()
-    
-    app.run(debug=False, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Reached with DSC_DEV set, or when gunicorn isn't installed
+    app.run(debug=False, host='0.0.0.0', port=5000)
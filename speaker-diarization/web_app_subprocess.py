@@ -4,179 +4,634 @@ Web interface for speaker diarization pipeline using subprocess calls
 This avoids import issues by calling the transcription script as a subprocess
 """
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Request, Response, render_template, request, jsonify, send_file
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
 from werkzeug.utils import secure_filename
 import os
+import importlib.util
+import re
 import json
+import shutil
+import hashlib
+import sqlite3
+import atexit
 import threading
 import subprocess
+import sys
 import time
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+
+# `python web_app_subprocess.py` hands the process over to gunicorn before
+# any of the module-level setup below runs (status database, janitor,
+# executor). The gunicorn worker imports web_app_subprocess:app itself, so
+# nothing is started twice or carried across its fork.
+if __name__ == '__main__':
+    print("=" * 60)
+    print("SPEAKER DIARIZATION WEB INTERFACE")
+    print("=" * 60)
+    print()
+    
+    # Check for HF_TOKEN
+    if not os.environ.get('HF_TOKEN'):
+        print("⚠️  Warning: HF_TOKEN not set")
+        print("   Speaker diarization will not work without it.")
+        print("   Set it with: export HF_TOKEN='your_token_here'")
+        print()
+    
+    print("This version uses subprocess calls to avoid import issues.")
+    print("Starting server at http://localhost:5000")
+    print("Press Ctrl+C to stop")
+    print()
+    
+    if not os.environ.get('DSC_DEV'):
+        if importlib.util.find_spec('gunicorn') is None:
+            print("gunicorn not installed, falling back to the Flask development server")
+        else:
+            os.execvp(sys.executable, [
+                sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_conf.py', 'web_app_subprocess:app'
+            ])
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class HashingFile:
+    """File wrapper that hashes everything written through it"""
+    
+    def __init__(self, file):
+        self._file = file
+        self.hash = hashlib.blake2b(digest_size=16)
+    
+    def write(self, data):
+        self.hash.update(data)
+        return self._file.write(data)
+    
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+class UploadRequest(Request):
+    """
+    Request that streams an uploaded audio file straight to its final path
+    in the upload folder, instead of Werkzeug's temporary file followed by
+    a second copy in FileStorage.save().
+    """
+    upload_job_id = None
+    upload_filename = None
+    upload_path = None
+    upload_stream = None
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.path != '/upload' or not filename or self.upload_path:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        
+        self.upload_filename = secure_filename(filename)
+        # Reject other file types before any of the body is written out
+        if not allowed_file(self.upload_filename):
+            raise UnsupportedMediaType()
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.upload_job_id = f"{timestamp}_{Path(self.upload_filename).stem}"
+        self.upload_path = os.path.join(
+            UPLOAD_FOLDER, f"{self.upload_job_id}_{self.upload_filename}"
+        )
+        # The form parser writes the body here, then seeks back to the start
+        self.upload_stream = HashingFile(open(self.upload_path, 'wb+'))
+        return self.upload_stream
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'output'
+app.config['JOBS_DB'] = 'jobs.db'
+# Behind a proxy that honours X-Sendfile, let it serve the downloads itself
+app.use_x_sendfile = os.environ.get('DSC_X_SENDFILE') == '1'
 
 # Ensure directories exist
 Path(app.config['UPLOAD_FOLDER']).mkdir(exist_ok=True)
 Path(app.config['OUTPUT_FOLDER']).mkdir(exist_ok=True)
 
-# Global storage for processing status
-processing_status = {}
+# Resolved once at import; handlers and workers join file names onto these
+UPLOAD_FOLDER = os.path.abspath(app.config['UPLOAD_FOLDER'])
+OUTPUT_FOLDER = os.path.abspath(app.config['OUTPUT_FOLDER'])
+
+# Job status and the result cache live in SQLite, so jobs survive a server
+# restart. Each thread gets its own connection, so with WAL mode status reads
+# proceed while a worker is writing
+_jobs_local = threading.local()
+
+def jobs_db():
+    """Return this thread's connection to the jobs database"""
+    conn = getattr(_jobs_local, 'conn', None)
+    if conn is None:
+        conn = _jobs_local.conn = sqlite3.connect(app.config['JOBS_DB'], isolation_level=None)
+    return conn
+
+jobs_db().execute('PRAGMA journal_mode=WAL')
+jobs_db().execute(
+    'CREATE TABLE IF NOT EXISTS jobs ('
+    'id TEXT PRIMARY KEY, status TEXT NOT NULL, end_time TEXT, data TEXT NOT NULL)'
+)
+jobs_db().execute('CREATE INDEX IF NOT EXISTS jobs_end_time ON jobs (end_time)')
+# Results of finished jobs keyed by the upload's content hash and settings,
+# so a re-uploaded file reuses them instead of being transcribed again
+jobs_db().execute(
+    'CREATE TABLE IF NOT EXISTS audio_cache ('
+    'hash TEXT NOT NULL, model TEXT NOT NULL, speakers INTEGER NOT NULL, '
+    'job_id TEXT NOT NULL, output_files TEXT NOT NULL, segments INTEGER NOT NULL, '
+    'PRIMARY KEY (hash, model, speakers))'
+)
+jobs_db().execute('CREATE INDEX IF NOT EXISTS audio_cache_job_id ON audio_cache (job_id)')
+jobs_db_lock = threading.Lock()
+# Content hash of each queued job's upload, until the job finishes
+job_hashes = {}
+
+# Status writes happen under processing_lock; reads go straight to the
+# database. Past MAX_JOBS the oldest finished jobs are dropped, and the
+# janitor forgets finished jobs (and deletes their files) once they are
+# older than JOB_TTL.
 processing_lock = threading.Lock()
+MAX_JOBS = int(os.environ.get('DSC_MAX_JOBS', '512'))
+JOB_TTL = timedelta(hours=float(os.environ.get('DSC_JOB_TTL_HOURS', '24')))
+JANITOR_INTERVAL = 5 * 60
+# Notified (under processing_lock) on every status change, so /status
+# long-polls and /events streams wake up instead of the browser polling
+processing_cv = threading.Condition(processing_lock)
+
+# Shared pool for transcription batches; bounds how many run on the GPU at
+# once. Sized by GPU_SLOTS (run_web_interface.sh derives it from free VRAM),
+# with DSC_WORKERS taking precedence
+EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('DSC_WORKERS') or os.environ.get('GPU_SLOTS', '2')),
+    thread_name_prefix='transcribe'
+)
+atexit.register(EXECUTOR.shutdown, wait=False)
+
+# Python interpreter for the transcription script: the project venv if
+# present, otherwise whichever interpreter runs this server
+VENV_DIR = os.path.abspath('venv')
+VENV_PY = os.path.join(VENV_DIR, 'bin', 'python')
+if not os.path.exists(VENV_PY):
+    VENV_DIR = None
+    VENV_PY = sys.executable
+
+# Command prefix and environment shared by every transcription run; the
+# environment is what `source venv/bin/activate` would export
+BASE_CMD = (VENV_PY, 'transcribe_with_speakers.py')
+BASE_ENV = {**os.environ, 'PYTHONUNBUFFERED': '1'}
+if VENV_DIR:
+    BASE_ENV['VIRTUAL_ENV'] = VENV_DIR
+    BASE_ENV['PATH'] = os.path.join(VENV_DIR, 'bin') + os.pathsep + BASE_ENV.get('PATH', '')
+
+# Uploads waiting for a worker, as (job_id, file_path, whisper_model, num_speakers).
+# A free worker runs every pending job with matching settings in one batch.
+pending_jobs = []
+pending_lock = threading.Lock()
+BATCH_MAX = int(os.environ.get('DSC_BATCH_MAX', '8'))
+
+# Step markers printed by transcribe_with_speakers.py ("1. Transcribing audio...")
+# mapped to the progress they represent
+STEP_RE = re.compile(r'^([1-5])\. (.+)$')
+STEP_PROGRESS = {'1': 50, '2': 65, '3': 75, '4': 85, '5': 90}
+
+# Per-file JSON summary line printed by transcribe_with_speakers.py
+SUMMARY_PREFIX = 'DSC_SUMMARY '
+
+# Output file extension -> key in a job's output_files
+OUTPUT_KEYS = {'txt': 'text', 'json': 'json', 'srt': 'srt'}
+OUTPUT_EXTS = {key: ext for ext, key in OUTPUT_KEYS.items()}
+
+# With zstandard installed, finished outputs are stored as .zst files and
+# sent as-is to clients that accept zstd
+ZSTD_LEVEL = 3
 
 # Allowed audio extensions
-ALLOWED_EXTENSIONS = {'mp3', 'wav', 'm4a', 'flac', 'ogg', 'opus', 'webm'}
+ALLOWED_EXTENSIONS = frozenset(('mp3', 'wav', 'm4a', 'flac', 'ogg', 'opus', 'webm'))
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-class SubprocessProcessingThread(threading.Thread):
-    """Background thread that calls transcription script via subprocess"""
-    
-    def __init__(self, file_path, job_id, whisper_model='base', num_speakers=2):
-        super().__init__()
-        self.file_path = file_path
-        self.job_id = job_id
-        self.whisper_model = whisper_model
-        self.num_speakers = num_speakers
-        self.daemon = True
+    _, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in ALLOWED_EXTENSIONS
+
+def read_status(job_id):
+    """Return the status dict for a job, or None if unknown"""
+    row = jobs_db().execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def _write_status(job_id, status):
+    """Store a job's status (caller holds processing_lock)"""
+    jobs_db().execute(
+        'INSERT INTO jobs (id, status, end_time, data) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT(id) DO UPDATE SET '
+        'status = excluded.status, end_time = excluded.end_time, data = excluded.data',
+        (job_id, status['status'], status.get('end_time'), json.dumps(status))
+    )
+
+def _update_jobs(job_ids, **fields):
+    """Merge fields into the status of each job and wake any watchers"""
+    with processing_lock:
+        for job_id in job_ids:
+            _write_status(job_id, {**read_status(job_id), **fields})
+        processing_cv.notify_all()
+
+def _pop_jobs(rows):
+    """
+    Delete the given (id, data) job rows, and the cache entries pointing at
+    their files, and return them as {job_id: status}
+    """
+    jobs = {job_id: json.loads(data) for job_id, data in rows}
+    ids = [(job_id,) for job_id in jobs]
+    jobs_db().executemany('DELETE FROM jobs WHERE id = ?', ids)
+    with jobs_db_lock:
+        jobs_db().executemany('DELETE FROM audio_cache WHERE job_id = ?', ids)
+    return jobs
+
+def _cache_store(digest, whisper_model, num_speakers, job_id, output_files, segments):
+    """Remember a finished job's outputs for its upload's content hash"""
+    with jobs_db_lock:
+        jobs_db().execute(
+            'INSERT OR REPLACE INTO audio_cache VALUES (?, ?, ?, ?, ?, ?)',
+            (digest, whisper_model, num_speakers, job_id, json.dumps(output_files), segments)
+        )
+
+def _cache_reuse(digest, whisper_model, num_speakers, file_path):
+    """
+    Hard-link the outputs of an earlier job on identical audio under the
+    names the transcription script would have given this upload.
+    
+    Returns:
+        (output_files, segments), or None if nothing usable is cached
+    """
+    row = jobs_db().execute(
+        'SELECT output_files, segments FROM audio_cache WHERE hash = ? AND model = ? AND speakers = ?',
+        (digest, whisper_model, num_speakers)
+    ).fetchone()
+    if row is None:
+        return None
+    
+    cached_files, segments = json.loads(row[0]), row[1]
+    base_name = Path(file_path).stem + "_transcribed"
+    output_files = {}
+    try:
+        for key, name in cached_files.items():
+            new_name = f"{base_name}.{OUTPUT_EXTS[key]}"
+            if name.endswith('.zst'):
+                new_name += '.zst'
+            src = os.path.join(OUTPUT_FOLDER, name)
+            dst = os.path.join(OUTPUT_FOLDER, new_name)
+            try:
+                os.link(src, dst)
+            except OSError:
+                # No hard links here; if src is gone the copy fails too
+                shutil.copyfile(src, f"{dst}.tmp")
+                os.replace(f"{dst}.tmp", dst)
+            output_files[key] = new_name
+    except FileNotFoundError:
+        # The earlier job's files have been cleaned up
+        for name in output_files.values():
+            os.unlink(os.path.join(OUTPUT_FOLDER, name))
+        return None
+    return output_files, segments
+
+def _evict_jobs():
+    """
+    Drop the oldest finished jobs beyond MAX_JOBS. The caller holds
+    processing_lock and should pass the result to _delete_job_files once
+    it has released it.
+    """
+    excess = jobs_db().execute('SELECT COUNT(*) FROM jobs').fetchone()[0] - MAX_JOBS
+    if excess <= 0:
+        return {}
+    return _pop_jobs(jobs_db().execute(
+        'SELECT id, data FROM jobs WHERE end_time IS NOT NULL ORDER BY rowid LIMIT ?',
+        (excess,)
+    ).fetchall())
+
+def _expire_jobs():
+    """Forget finished jobs older than JOB_TTL and delete their files"""
+    cutoff = (datetime.now() - JOB_TTL).isoformat()
+    with processing_lock:
+        expired = _pop_jobs(jobs_db().execute(
+            'SELECT id, data FROM jobs WHERE end_time < ?', (cutoff,)
+        ).fetchall())
+    _delete_job_files(expired)
+
+def _delete_job_files(jobs):
+    """Delete the uploads, outputs and logs of forgotten jobs ({job_id: status})"""
+    if not jobs:
+        return
+    
+    paths = []
+    for status in jobs.values():
+        names = list(status.get('output_files', {}).values())
+        if 'log' in status:
+            names.append(status['log'])
+        paths.extend(os.path.join(OUTPUT_FOLDER, name) for name in names)
+    # Uploads are named "<job_id>_<stem>.<ext>", and job ids end in that stem
+    upload_stems = {f"{job_id}_{job_id.split('_', 2)[-1]}" for job_id in jobs}
+    with os.scandir(UPLOAD_FOLDER) as entries:
+        paths.extend(
+            entry.path for entry in entries
+            if entry.name.rpartition('.')[0] in upload_stems
+        )
+    
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+def _janitor():
+    """Background loop that expires old jobs every JANITOR_INTERVAL seconds"""
+    while True:
+        time.sleep(JANITOR_INTERVAL)
+        try:
+            _expire_jobs()
+        except Exception as e:
+            print(f"Janitor error: {e}")
+
+def _fail_interrupted_jobs():
+    """Mark jobs a previous server process left unfinished as failed"""
+    with processing_lock:
+        rows = jobs_db().execute('SELECT id, data FROM jobs WHERE end_time IS NULL').fetchall()
+        for job_id, data in rows:
+            _write_status(job_id, {
+                **json.loads(data),
+                'status': 'error',
+                'progress': 0,
+                'message': 'Error: Interrupted by a server restart',
+                'end_time': datetime.now().isoformat()
+            })
+
+_fail_interrupted_jobs()
+threading.Thread(target=_janitor, name='janitor', daemon=True).start()
+
+def _run_pending():
+    """
+    Take every pending job that shares the first job's settings (up to
+    BATCH_MAX) and run them in one subprocess, so the models are loaded
+    once for the whole batch.
+    """
+    with pending_lock:
+        if not pending_jobs:
+            return  # Already picked up by another worker's batch
+        whisper_model, num_speakers = pending_jobs[0][2], pending_jobs[0][3]
+        batch = [job for job in pending_jobs if job[2:] == (whisper_model, num_speakers)][:BATCH_MAX]
+        for job in batch:
+            pending_jobs.remove(job)
+    _run_batch([job[:2] for job in batch], whisper_model, num_speakers)
+
+def _run_batch(jobs, whisper_model='base', num_speakers=2):
+    """
+    Run the transcription script once for a batch of jobs via subprocess.
+    
+    Args:
+        jobs: List of (job_id, file_path) pairs
+        whisper_model: Whisper model size shared by the batch
+        num_speakers: Number of speakers shared by the batch
+    """
+    job_ids = [job_id for job_id, _ in jobs]
+    job_for_path = {file_path: job_id for job_id, file_path in jobs}
+    try:
+        _update_jobs(job_ids, status='processing', progress=30, message='Starting transcription...')
         
-    def run(self):
-        """Run the transcription process via subprocess"""
-        global processing_status
+        # Build command
+        cmd = [
+            *BASE_CMD, *job_for_path,
+            '--whisper-model', whisper_model,
+            '--num-speakers', str(num_speakers),
+            '--output-dir', OUTPUT_FOLDER
+        ]
+        
+        # Run the transcription, streaming its output to per-job log files
+        # as it arrives rather than buffering it all in memory. The script
+        # prints "Processing: <path>" before each file, which tells us whose
+        # log (and progress) the following lines belong to.
+        tails = {job_id: deque(maxlen=50) for job_id in job_ids}
+        segments = dict.fromkeys(job_ids, 0)
+        current = None
+        
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=1024 * 1024,
+            env=BASE_ENV,
+            cwd=os.getcwd()
+        )
         
         try:
-            # Update status
-            with processing_lock:
-                processing_status[self.job_id] = {
-                    'status': 'processing',
-                    'progress': 10,
-                    'message': 'Initializing...',
-                    'start_time': datetime.now().isoformat()
+            with ExitStack() as stack:
+                logs = {
+                    job_id: stack.enter_context(open(
+                        os.path.join(OUTPUT_FOLDER, f"{job_id}.log"),
+                        'wb', buffering=1024 * 1024
+                    ))
+                    for job_id in job_ids
                 }
-            
-            # Update progress
-            with processing_lock:
-                processing_status[self.job_id]['progress'] = 30
-                processing_status[self.job_id]['message'] = 'Starting transcription...'
-            
-            # Build command
-            cmd = [
-                'bash', '-c',
-                f'source venv/bin/activate && python transcribe_with_speakers.py "{self.file_path}" --whisper-model {self.whisper_model} --num-speakers {self.num_speakers} --output-dir {app.config["OUTPUT_FOLDER"]}'
-            ]
-            
-            # Set up environment
-            env = os.environ.copy()
-            env['PYTHONUNBUFFERED'] = '1'
-            
-            # Update progress
-            with processing_lock:
-                processing_status[self.job_id]['progress'] = 50
-                processing_status[self.job_id]['message'] = 'Running WhisperX transcription...'
-            
-            # Run the transcription
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                env=env,
-                cwd=os.getcwd()
-            )
-            
-            # Monitor process
-            stdout, stderr = process.communicate()
-            
-            if process.returncode == 0:
-                # Success - update progress
-                with processing_lock:
-                    processing_status[self.job_id]['progress'] = 90
-                    processing_status[self.job_id]['message'] = 'Processing complete, preparing files...'
-                
-                # Find output files
-                base_name = Path(self.file_path).stem
-                output_files = {}
-                
-                # Look for generated files in output directory
-                for ext in ['txt', 'json', 'srt']:
-                    pattern_files = list(Path(app.config['OUTPUT_FOLDER']).glob(f"*{base_name}*.{ext}"))
-                    if pattern_files:
-                        # Use the most recent file
-                        output_files[ext if ext != 'txt' else 'text'] = pattern_files[-1].name
-                
-                # If no files found, create basic output from stdout
-                if not output_files:
-                    output_base = f"{self.job_id}_{base_name}"
-                    txt_file = f"{output_base}.txt"
-                    json_file = f"{output_base}.json"
-                    srt_file = f"{output_base}.srt"
-                    
-                    # Save stdout as text output
-                    with open(os.path.join(app.config['OUTPUT_FOLDER'], txt_file), 'w') as f:
-                        f.write(f"Transcription Output:\n\n{stdout}")
-                    
-                    # Create basic JSON
-                    with open(os.path.join(app.config['OUTPUT_FOLDER'], json_file), 'w') as f:
-                        json.dump({
-                            'stdout': stdout,
-                            'processing_info': {
-                                'job_id': self.job_id,
-                                'model': self.whisper_model,
-                                'speakers': self.num_speakers,
-                                'completed_at': datetime.now().isoformat()
-                            }
-                        }, f, indent=2)
-                    
-                    # Create basic SRT
-                    with open(os.path.join(app.config['OUTPUT_FOLDER'], srt_file), 'w') as f:
-                        f.write("1\n00:00:00,000 --> 00:01:00,000\n" + stdout[:100] + "...\n")
-                    
-                    output_files = {
-                        'text': txt_file,
-                        'json': json_file,
-                        'srt': srt_file
-                    }
+                for raw in iter(process.stdout.readline, b''):
+                    line = raw.decode('utf-8', errors='replace').strip()
+                    if line.startswith('Processing: '):
+                        current = job_for_path.get(line[len('Processing: '):], current)
                 
-                # Count segments (rough estimate)
-                segments = len([line for line in stdout.split('\n') if '[' in line and ']' in line])
+                    for job_id in ([current] if current else job_ids):
+                        logs[job_id].write(raw)
+                        tails[job_id].append(line)
+                    if current is None:
+                        continue
                 
-                # Update final status
-                with processing_lock:
-                    processing_status[self.job_id] = {
-                        'status': 'completed',
-                        'progress': 100,
-                        'message': 'Processing complete!',
-                        'output_files': output_files,
-                        'segments': segments,
-                        'stdout': stdout,
-                        'end_time': datetime.now().isoformat()
-                    }
-            else:
-                # Error occurred
-                error_msg = f"Transcription failed (exit code {process.returncode})\nSTDOUT: {stdout}\nSTDERR: {stderr}"
-                with processing_lock:
-                    processing_status[self.job_id] = {
-                        'status': 'error',
-                        'progress': 0,
-                        'message': f'Error: {error_msg}',
-                        'stdout': stdout,
-                        'stderr': stderr,
-                        'end_time': datetime.now().isoformat()
-                    }
+                    if line.startswith(SUMMARY_PREFIX):
+                        summary = json.loads(line[len(SUMMARY_PREFIX):])
+                        segments[current] = summary.get('segments', 0)
+                        continue
                 
-        except Exception as e:
-            # Handle errors
-            with processing_lock:
-                processing_status[self.job_id] = {
+                    step = STEP_RE.match(line)
+                    if step:
+                        _update_jobs([current], progress=STEP_PROGRESS[step.group(1)], message=step.group(2))
+        
+            process.wait()
+        except BaseException:
+            # Reading its output failed; don't leave the script running on
+            # the GPU with nobody reading it
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            process.stdout.close()
+        
+        found = _find_outputs([Path(file_path).stem for _, file_path in jobs])
+        for job_id, file_path in jobs:
+            _finish_job(
+                job_id, file_path, found[Path(file_path).stem], process.returncode,
+                segments[job_id], tails[job_id], whisper_model, num_speakers
+            )
+            
+    except Exception as e:
+        # Handle errors
+        with processing_lock:
+            for job_id in job_ids:
+                job_hashes.pop(job_id, None)
+                _write_status(job_id, {
                     'status': 'error',
                     'progress': 0,
                     'message': f'Error: {str(e)}',
                     'end_time': datetime.now().isoformat()
-                }
+                })
+            processing_cv.notify_all()
+
+def _write_atomic(path, data):
+    """Write bytes to path via a temp file, so readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _output_path(name):
+    """Path of an output file by name, or None if the name escapes OUTPUT_FOLDER"""
+    path = os.path.abspath(os.path.join(OUTPUT_FOLDER, name))
+    if os.path.commonpath((OUTPUT_FOLDER, path)) != OUTPUT_FOLDER:
+        return None
+    return path
+
+def _compress_outputs(output_files):
+    """Replace each output file with a zstd-compressed .zst copy"""
+    if zstandard is None:
+        return output_files
+    cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    compressed = {}
+    for key, name in output_files.items():
+        path = os.path.join(OUTPUT_FOLDER, name)
+        tmp_path = f"{path}.zst.tmp"
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            cctx.copy_stream(src, dst)
+        os.replace(tmp_path, f"{path}.zst")
+        os.unlink(path)
+        compressed[key] = f"{name}.zst"
+    return compressed
+
+def _open_output(path):
+    """Open an output file for reading its plain contents"""
+    f = open(path, 'rb')
+    if path.endswith('.zst'):
+        return zstandard.ZstdDecompressor().stream_reader(f, closefd=True)
+    return f
+
+def _plain_name(name):
+    """Output file name as the user should see it, without any .zst suffix"""
+    return name[:-len('.zst')] if name.endswith('.zst') else name
+
+def _find_outputs(base_names):
+    """
+    Find the generated output files for several uploads with a single scan
+    of the output folder.
+    
+    Returns:
+        {base_name: {'text'|'json'|'srt': filename}}
+    """
+    found = {base_name: {} for base_name in base_names}
+    with os.scandir(OUTPUT_FOLDER) as entries:
+        for name in sorted(entry.name for entry in entries):
+            stem, _, ext = name.rpartition('.')
+            key = OUTPUT_KEYS.get(ext)
+            if key is None:
+                continue
+            for base_name in base_names:
+                if base_name in stem:
+                    found[base_name][key] = name
+    return found
+
+def _finish_job(job_id, file_path, output_files, returncode, segments, tail, whisper_model, num_speakers):
+    """Record the outcome of one job once its batch's subprocess has exited"""
+    log_name = f"{job_id}.log"
+    log_path = os.path.join(OUTPUT_FOLDER, log_name)
+    base_name = Path(file_path).stem
+    digest = job_hashes.pop(job_id, None)
+    
+    # Another file in the batch may have failed; this one still succeeded
+    # if it produced its outputs
+    if returncode != 0 and not output_files:
+        output = '\n'.join(tail)
+        error_msg = f"Transcription failed (exit code {returncode})\nOUTPUT (last {len(tail)} lines): {output}"
+        with processing_lock:
+            _write_status(job_id, {
+                'status': 'error',
+                'progress': 0,
+                'message': f'Error: {error_msg}',
+                'log': log_name,
+                'end_time': datetime.now().isoformat()
+            })
+            processing_cv.notify_all()
+        return
+    
+    cacheable = digest and len(output_files) == len(OUTPUT_KEYS)
+    
+    # If no files found, create basic output from stdout
+    if not output_files:
+        with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+            stdout = f.read()
+        output_base = f"{job_id}_{base_name}"
+        txt_file = f"{output_base}.txt"
+        json_file = f"{output_base}.json"
+        srt_file = f"{output_base}.srt"
+        
+        # Save stdout as text output
+        _write_atomic(
+            os.path.join(OUTPUT_FOLDER, txt_file),
+            f"Transcription Output:\n\n{stdout}".encode('utf-8')
+        )
+        
+        # Create basic JSON
+        json_data = {
+            'stdout': stdout,
+            'processing_info': {
+                'job_id': job_id,
+                'model': whisper_model,
+                'speakers': num_speakers,
+                'completed_at': datetime.now().isoformat()
+            }
+        }
+        if orjson is not None:
+            json_bytes = orjson.dumps(json_data, option=orjson.OPT_INDENT_2)
+        else:
+            json_bytes = json.dumps(json_data, indent=2).encode('utf-8')
+        _write_atomic(os.path.join(OUTPUT_FOLDER, json_file), json_bytes)
+        
+        # Create basic SRT
+        _write_atomic(
+            os.path.join(OUTPUT_FOLDER, srt_file),
+            ("1\n00:00:00,000 --> 00:01:00,000\n" + stdout[:100] + "...\n").encode('utf-8')
+        )
+        
+        output_files = {
+            'text': txt_file,
+            'json': json_file,
+            'srt': srt_file
+        }
+    
+    output_files = _compress_outputs(output_files)
+    if cacheable:
+        _cache_store(digest, whisper_model, num_speakers, job_id, output_files, segments)
+    
+    # Update final status
+    with processing_lock:
+        _write_status(job_id, {
+            'status': 'completed',
+            'progress': 100,
+            'message': 'Processing complete!',
+            'output_files': output_files,
+            'segments': segments,
+            'log': log_name,
+            'end_time': datetime.now().isoformat()
+        })
+        processing_cv.notify_all()
 
 @app.route('/')
 def index():
@@ -187,31 +642,70 @@ def index():
 def upload_file():
     """Handle file upload and start processing"""
     
-    if 'audio' not in request.files:
+    file = request.files.get('audio')
+    if file is None:
+        _discard_upload()
         return jsonify({'error': 'No file provided'}), 400
     
-    file = request.files['audio']
     if file.filename == '':
+        _discard_upload()
         return jsonify({'error': 'No file selected'}), 400
     
-    if not allowed_file(file.filename):
-        return jsonify({'error': f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS)}'}), 400
+    if getattr(file.stream, 'name', None) != request.upload_path:
+        _discard_upload()
+        return jsonify({'error': 'The audio file must be the first file in the form'}), 400
     
-    # Save uploaded file
-    filename = secure_filename(file.filename)
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    job_id = f"{timestamp}_{Path(filename).stem}"
-    
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}_{filename}")
-    file.save(file_path)
+    # Already written to its final path while the form was parsed
+    file.close()
+    filename = request.upload_filename
+    job_id = request.upload_job_id
+    file_path = request.upload_path
     
     # Get processing parameters
     whisper_model = request.form.get('model', 'base')
     num_speakers = int(request.form.get('speakers', 2))
     
-    # Start processing in background
-    processor = SubprocessProcessingThread(file_path, job_id, whisper_model, num_speakers)
-    processor.start()
+    # Identical audio with the same settings: reuse the earlier result
+    digest = request.upload_stream.hash.hexdigest()
+    cached = _cache_reuse(digest, whisper_model, num_speakers, file_path)
+    if cached:
+        output_files, segments = cached
+        _discard_upload()
+        _cache_store(digest, whisper_model, num_speakers, job_id, output_files, segments)
+        with processing_lock:
+            _write_status(job_id, {
+                'status': 'completed',
+                'progress': 100,
+                'message': 'Processing complete! (reused an earlier identical upload)',
+                'output_files': output_files,
+                'segments': segments,
+                'start_time': datetime.now().isoformat(),
+                'end_time': datetime.now().isoformat()
+            })
+            evicted = _evict_jobs()
+            processing_cv.notify_all()
+        _delete_job_files(evicted)
+        return jsonify({
+            'job_id': job_id,
+            'message': 'Processing started',
+            'filename': filename
+        })
+    
+    # Queue processing on the shared pool
+    with processing_lock:
+        _write_status(job_id, {
+            'status': 'pending',
+            'progress': 0,
+            'message': 'Waiting for a free worker...',
+            'start_time': datetime.now().isoformat()
+        })
+        evicted = _evict_jobs()
+        processing_cv.notify_all()
+    _delete_job_files(evicted)
+    job_hashes[job_id] = digest
+    with pending_lock:
+        pending_jobs.append((job_id, file_path, whisper_model, num_speakers))
+    EXECUTOR.submit(_run_pending)
     
     return jsonify({
         'job_id': job_id,
@@ -219,89 +713,177 @@ def upload_file():
         'filename': filename
     })
 
+@app.before_request
+def preflight_upload():
+    """Turn away uploads that can't succeed before reading their body"""
+    if request.method != 'POST' or request.path != '/upload':
+        return None
+    if request.mimetype != 'multipart/form-data':
+        raise UnsupportedMediaType()
+    if request.content_length is not None and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        raise RequestEntityTooLarge()
+    return None
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    """Reject an oversize upload, removing anything already streamed to disk"""
+    _remove_partial_upload()
+    limit = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({'error': f'File too large (max {limit}MB)'}), 413
+
+@app.errorhandler(UnsupportedMediaType)
+def upload_wrong_type(e):
+    """Reject an upload that isn't a multipart form with an audio file"""
+    _remove_partial_upload()
+    return jsonify({'error': f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS)}'}), 415
+
+def _remove_partial_upload():
+    """Remove a streamed upload whose form failed to parse"""
+    if request.upload_stream is not None:
+        request.upload_stream.close()
+    if request.upload_path and os.path.exists(request.upload_path):
+        os.remove(request.upload_path)
+
+def _discard_upload():
+    """Remove a streamed upload that won't be processed"""
+    for f in request.files.values():
+        f.close()
+    if request.upload_path and os.path.exists(request.upload_path):
+        os.remove(request.upload_path)
+
+def _status_settled(job_id, since):
+    """True once a job has moved past `since` progress or finished"""
+    status = read_status(job_id)
+    return (status is None
+            or status.get('progress', 0) > since
+            or status['status'] in ('completed', 'error'))
+
 @app.route('/status/<job_id>')
 def get_status(job_id):
-    """Get processing status"""
-    with processing_lock:
-        if job_id in processing_status:
-            return jsonify(processing_status[job_id])
-        else:
-            return jsonify({'error': 'Job not found'}), 404
+    """Get processing status; with ?since=<progress>, wait up to 25s for a change"""
+    since = request.args.get('since', type=int)
+    if since is not None:
+        with processing_cv:
+            processing_cv.wait_for(lambda: _status_settled(job_id, since), timeout=25)
+    
+    status = read_status(job_id)
+    if status is not None:
+        return jsonify(status)
+    else:
+        return jsonify({'error': 'Job not found'}), 404
+
+@app.route('/events/<job_id>')
+def stream_status(job_id):
+    """Stream status changes as Server-Sent Events until the job finishes"""
+    if read_status(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def snapshot():
+        row = jobs_db().execute('SELECT status, data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row or (None, None)
+    
+    def generate():
+        last_sent = None
+        while True:
+            with processing_cv:
+                processing_cv.wait_for(lambda: snapshot()[1] != last_sent, timeout=15)
+                status, data = snapshot()
+            if data is None:
+                return
+            if data == last_sent:
+                yield ": keepalive\n\n"
+                continue
+            yield f"data: {data}\n\n"
+            last_sent = data
+            if status in ('completed', 'error'):
+                return
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/transcript/<job_id>')
 def get_transcript(job_id):
     """Get transcript content"""
-    with processing_lock:
-        if job_id not in processing_status:
-            return jsonify({'error': 'Job not found'}), 404
-        
-        status = processing_status[job_id]
-        if status['status'] != 'completed':
-            return jsonify({'error': 'Processing not complete'}), 400
-        
-        # Read transcript file
-        txt_file = os.path.join(app.config['OUTPUT_FOLDER'], status['output_files']['text'])
-        if not os.path.exists(txt_file):
-            return jsonify({'error': 'Transcript file not found'}), 404
-        
-        with open(txt_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        return jsonify({
-            'content': content,
-            'filename': status['output_files']['text']
-        })
+    status = read_status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if status['status'] != 'completed':
+        return jsonify({'error': 'Processing not complete'}), 400
+    
+    # Read transcript file
+    txt_file = _output_path(status['output_files']['text'])
+    if txt_file is None or not os.path.exists(txt_file):
+        return jsonify({'error': 'Transcript file not found'}), 404
+    
+    with _open_output(txt_file) as f:
+        content = f.read().decode('utf-8')
+    
+    return jsonify({
+        'content': content,
+        'filename': _plain_name(status['output_files']['text'])
+    })
 
 @app.route('/download/<job_id>/<file_type>')
 def download_file(job_id, file_type):
     """Download output file"""
-    with processing_lock:
-        if job_id not in processing_status:
-            return jsonify({'error': 'Job not found'}), 404
-        
-        status = processing_status[job_id]
-        if status['status'] != 'completed':
-            return jsonify({'error': 'Processing not complete'}), 400
-        
-        if file_type not in ['text', 'json', 'srt']:
-            return jsonify({'error': 'Invalid file type'}), 400
-        
-        file_path = os.path.join(app.config['OUTPUT_FOLDER'], status['output_files'][file_type])
-        if not os.path.exists(file_path):
-            return jsonify({'error': 'File not found'}), 404
-        
-        return send_file(file_path, as_attachment=True)
+    status = read_status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if status['status'] != 'completed':
+        return jsonify({'error': 'Processing not complete'}), 400
+    
+    if file_type not in ['text', 'json', 'srt']:
+        return jsonify({'error': 'Invalid file type'}), 400
+    
+    name = status['output_files'][file_type]
+    file_path = _output_path(name)
+    if file_path is None or not os.path.exists(file_path):
+        return jsonify({'error': 'File not found'}), 404
+    
+    download_name = _plain_name(name)
+    compressed = name.endswith('.zst')
+    if compressed and 'zstd' not in request.accept_encodings:
+        # Client can't decode zstd: decompress while streaming
+        response = send_file(
+            _open_output(file_path),
+            as_attachment=True,
+            download_name=download_name
+        )
+    else:
+        # Conditional + range responses; under gunicorn the body goes out via sendfile(2)
+        response = send_file(
+            file_path,
+            as_attachment=True,
+            download_name=download_name,
+            conditional=True,
+            etag=True,
+            max_age=3600,
+            last_modified=os.path.getmtime(file_path)
+        )
+        if compressed:
+            response.headers['Content-Encoding'] = 'zstd'
+    if compressed:
+        response.vary.add('Accept-Encoding')
+    return response
 
 @app.route('/jobs')
 def list_jobs():
-    """List all processing jobs"""
-    with processing_lock:
-        jobs = []
-        for job_id, status in processing_status.items():
-            jobs.append({
-                'id': job_id,
-                'status': status['status'],
-                'message': status.get('message', ''),
-                'progress': status.get('progress', 0)
-            })
-        return jsonify(jobs)
+    """List the 100 most recent processing jobs"""
+    jobs = []
+    for job_id, data in jobs_db().execute('SELECT id, data FROM jobs ORDER BY rowid DESC LIMIT 100'):
+        status = json.loads(data)
+        jobs.append({
+            'id': job_id,
+            'status': status['status'],
+            'message': status.get('message', ''),
+            'progress': status.get('progress', 0)
+        })
+    return jsonify(jobs)
 
 if __name__ == '__main__':
-    print("=" * 60)
-    print("SPEAKER DIARIZATION WEB INTERFACE")
-    print("=" * 60)
-    print()
-    
-    # Check for HF_TOKEN
-    if not os.environ.get('HF_TOKEN'):
-        print("⚠️  Warning: HF_TOKEN not set")
-        print("   Speaker diarization will not work without it.")
-        print("   Set it with: export HF_TOKEN='your_token_here'")
-        print()
-    
-    print("This version uses subprocess calls to avoid import issues.")
-    print("Starting server at http://localhost:5000")
-    print("Press Ctrl+C to stop")
-    print()
-    
-    app.run(debug=False, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Reached with DSC_DEV set, or when gunicorn isn't installed
+    app.run(debug=False, host='0.0.0.0', port=5000)
@@ -13,6 +13,11 @@ import time
 from pathlib import Path
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
@@ -27,10 +32,63 @@ processing_status = {}
 processing_lock = threading.Lock()
 
 # Allowed audio extensions
-ALLOWED_EXTENSIONS = {'mp3', 'wav', 'm4a', 'flac', 'ogg', 'opus', 'webm'}
+ALLOWED_EXTENSIONS = frozenset(('mp3', 'wav', 'm4a', 'flac', 'ogg', 'opus', 'webm'))
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    _, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in ALLOWED_EXTENSIONS
+
+# Simulated stage timings (seconds), only slept through with DSC_DEMO_REALISTIC set
+DEMO_REALISTIC = bool(os.environ.get('DSC_DEMO_REALISTIC'))
+DEMO_STEPS = (
+    (2, 30, 'Loading audio file...'),
+    (3, 60, 'Transcribing with Whisper...'),
+    (3, 80, 'Identifying speakers...'),
+    (1, 90, 'Saving results...'),
+)
+
+# Demo output; only the transcript header/footer and JSON metadata vary per job
+_DEMO_SEGMENTS = [
+    {"start": 0.0, "end": 5.0, "speaker": "SPEAKER_01", "text": "This is a demonstration of the speaker diarization pipeline."},
+    {"start": 5.0, "end": 8.0, "speaker": "SPEAKER_02", "text": "The system would normally identify who is speaking when."},
+    {"start": 8.0, "end": 12.0, "speaker": "SPEAKER_01", "text": "In this demo, we're showing how the web interface works."},
+    {"start": 12.0, "end": 15.0, "speaker": "SPEAKER_02", "text": "The actual processing would use WhisperX and PyAnnote for real transcription."}
+]
+
+_DEMO_TRANSCRIPT = """Demo Transcript - {base_name}
+Processing completed with model: {model}
+Speakers detected: {speakers}
+
+[00:00 - 00:05] SPEAKER_01: This is a demonstration of the speaker diarization pipeline.
+
+[00:05 - 00:08] SPEAKER_02: The system would normally identify who is speaking when.
+
+[00:08 - 00:12] SPEAKER_01: In this demo, we're showing how the web interface works.
+
+[00:12 - 00:15] SPEAKER_02: The actual processing would use WhisperX and PyAnnote for real transcription.
+
+Processing completed at: {finished}
+File: {file}
+Model: {model}
+Speakers: {speakers}
+"""
+
+_DEMO_SRT_BYTES = b"""1
+00:00:00,000 --> 00:00:05,000
+SPEAKER_01: This is a demonstration of the speaker diarization pipeline.
+
+2
+00:00:05,000 --> 00:00:08,000
+SPEAKER_02: The system would normally identify who is speaking when.
+
+3
+00:00:08,000 --> 00:00:12,000
+SPEAKER_01: In this demo, we're showing how the web interface works.
+
+4
+00:00:12,000 --> 00:00:15,000
+SPEAKER_02: The actual processing would use WhisperX and PyAnnote for real transcription.
+"""
 
 class DemoProcessingThread(threading.Thread):
     """Demo background thread that simulates audio processing"""
@@ -57,68 +115,34 @@ class DemoProcessingThread(threading.Thread):
                     'start_time': datetime.now().isoformat()
                 }
             
-            # Simulate initialization
-            time.sleep(2)
-            with processing_lock:
-                processing_status[self.job_id]['progress'] = 30
-                processing_status[self.job_id]['message'] = 'Loading audio file...'
-            
-            # Simulate transcription
-            time.sleep(3)
-            with processing_lock:
-                processing_status[self.job_id]['progress'] = 60
-                processing_status[self.job_id]['message'] = 'Transcribing with Whisper...'
-            
-            # Simulate diarization
-            time.sleep(3)
-            with processing_lock:
-                processing_status[self.job_id]['progress'] = 80
-                processing_status[self.job_id]['message'] = 'Identifying speakers...'
-            
-            # Simulate saving
-            time.sleep(1)
-            with processing_lock:
-                processing_status[self.job_id]['progress'] = 90
-                processing_status[self.job_id]['message'] = 'Saving results...'
+            # Simulate the pipeline stages
+            for delay, progress, message in DEMO_STEPS:
+                if DEMO_REALISTIC:
+                    time.sleep(delay)
+                with processing_lock:
+                    processing_status[self.job_id]['progress'] = progress
+                    processing_status[self.job_id]['message'] = message
             
             # Create demo output files
             base_name = Path(self.file_path).stem
             output_base = f"{self.job_id}_{base_name}"
             
-            # Create demo transcript
-            demo_transcript = f"""Demo Transcript - {base_name}
-Processing completed with model: {self.whisper_model}
-Speakers detected: {self.num_speakers}
-
-[00:00 - 00:05] SPEAKER_01: This is a demonstration of the speaker diarization pipeline.
-
-[00:05 - 00:08] SPEAKER_02: The system would normally identify who is speaking when.
-
-[00:08 - 00:12] SPEAKER_01: In this demo, we're showing how the web interface works.
-
-[00:12 - 00:15] SPEAKER_02: The actual processing would use WhisperX and PyAnnote for real transcription.
-
-Processing completed at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-File: {self.file_path}
-Model: {self.whisper_model}
-Speakers: {self.num_speakers}
-"""
-            
             # Save demo files
             txt_file = os.path.join(app.config['OUTPUT_FOLDER'], f"{output_base}.txt")
             json_file = os.path.join(app.config['OUTPUT_FOLDER'], f"{output_base}.json")
             srt_file = os.path.join(app.config['OUTPUT_FOLDER'], f"{output_base}.srt")
             
             with open(txt_file, 'w', encoding='utf-8') as f:
-                f.write(demo_transcript)
+                f.write(_DEMO_TRANSCRIPT.format(
+                    base_name=base_name,
+                    model=self.whisper_model,
+                    speakers=self.num_speakers,
+                    finished=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    file=self.file_path
+                ))
             
             demo_json = {
-                "segments": [
-                    {"start": 0.0, "end": 5.0, "speaker": "SPEAKER_01", "text": "This is a demonstration of the speaker diarization pipeline."},
-                    {"start": 5.0, "end": 8.0, "speaker": "SPEAKER_02", "text": "The system would normally identify who is speaking when."},
-                    {"start": 8.0, "end": 12.0, "speaker": "SPEAKER_01", "text": "In this demo, we're showing how the web interface works."},
-                    {"start": 12.0, "end": 15.0, "speaker": "SPEAKER_02", "text": "The actual processing would use WhisperX and PyAnnote for real transcription."}
-                ],
+                "segments": _DEMO_SEGMENTS,
                 "metadata": {
                     "processing_date": datetime.now().isoformat(),
                     "whisper_model": self.whisper_model,
@@ -127,28 +151,15 @@ Speakers: {self.num_speakers}
                 }
             }
             
-            with open(json_file, 'w', encoding='utf-8') as f:
-                json.dump(demo_json, f, indent=2)
-            
-            demo_srt = """1
-00:00:00,000 --> 00:00:05,000
-SPEAKER_01: This is a demonstration of the speaker diarization pipeline.
-
-2
-00:00:05,000 --> 00:00:08,000
-SPEAKER_02: The system would normally identify who is speaking when.
-
-3
-00:00:08,000 --> 00:00:12,000
-SPEAKER_01: In this demo, we're showing how the web interface works.
-
-4
-00:00:12,000 --> 00:00:15,000
-SPEAKER_02: The actual processing would use WhisperX and PyAnnote for real transcription.
-"""
+            if orjson is not None:
+                with open(json_file, 'wb') as f:
+                    f.write(orjson.dumps(demo_json, option=orjson.OPT_INDENT_2))
+            else:
+                with open(json_file, 'w', encoding='utf-8') as f:
+                    json.dump(demo_json, f, indent=2)
             
-            with open(srt_file, 'w', encoding='utf-8') as f:
-                f.write(demo_srt)
+            with open(srt_file, 'wb') as f:
+                f.write(_DEMO_SRT_BYTES)
             
             # Update final status
             with processing_lock: